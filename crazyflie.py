@@ -45,6 +45,7 @@ class Crazyflie(VecTask):
         
         self.max_episode_length = self.cfg["env"]["maxEpisodeLength"]
         self.debug_viz = self.cfg["env"]["enableDebugVis"]
+        self.target_layout = self.cfg["env"].get("targetLayout", "random")
         
         num_observations = 36
         num_actions = 4
@@ -71,7 +72,12 @@ class Crazyflie(VecTask):
         self.marker_positions = self.marker_states[:, 0:3]
         
         self.gym.refresh_actor_root_state_tensor(self.sim)
-        self.initial_root_states = self.root_states.clone()
+        # SoA copies of the spawn state, scattered field by field on reset instead
+        # of rewriting the full 13-wide root rows
+        self.initial_root_positions = self.root_positions.clone()
+        self.initial_root_quats = self.root_quats.clone()
+        self.initial_root_linvels = self.root_linvels.clone()
+        self.initial_root_angvels = self.root_angvels.clone()
         
         # set thrust limits
         max_thrust = 2
@@ -83,9 +89,35 @@ class Crazyflie(VecTask):
         self.forces = torch.zeros((self.num_envs, bodies_per_env, 3), dtype=torch.float32, device=self.device, requires_grad=False)
 
         self.all_actor_indices = torch.arange(self.num_envs * 2, dtype=torch.int32, device=self.device).reshape((self.num_envs, 2))
+        # persistent empty index tensor, reused every step instead of allocating new sentinels
+        self._empty_i32 = torch.empty(0, dtype=torch.int32, device=self.device)
+        # scratch mask over all actor indices, used to union reset indices without a sort
+        self._reset_mask = torch.zeros(self.num_envs * 2, dtype=torch.bool, device=self.device)
+
+        # per-env countdown until the next target refresh; cheaper than a modulo on
+        # progress_buf every step. Starts at 1 so all envs pick a target on the first step.
+        self.target_update_interval = 500
+        self.target_countdown = torch.ones(self.num_envs, dtype=torch.int32, device=self.device)
         
         self.controller = CTRBctrl(self.num_envs, device=self.device)
-        self.friction = torch.zeros((self.num_envs, bodies_per_env, 3), device=self.device, dtype=torch.float32)
+
+        # device-resident constants for the scripted kernels, so no host scalar is
+        # re-boxed and copied to the GPU every call
+        self.inv_pi = torch.tensor(1.0 / math.pi, device=self.device, dtype=torch.float32)
+        self.max_progress = torch.tensor(self.max_episode_length - 1, dtype=torch.long, device=self.device)
+
+        # optional CUDA-graph replay of the static observation/reward block;
+        # captured lazily on the first post-physics step
+        self.enable_cuda_graph = self.cfg["env"].get("enableCudaGraph", False)
+        self._obs_reward_graph = None
+
+        # optional bfloat16 shadow of the observations for policy I/O; physics and
+        # reward stay FP32
+        self.bf16_obs = self.cfg["env"].get("bf16Obs", False)
+        if self.bf16_obs:
+            self.obs_buf_bf16 = torch.empty_like(self.obs_buf, dtype=torch.bfloat16)
+        # env-level mask fed to the fused force assembly so reset envs get zero force
+        self._force_reset_mask = torch.zeros(self.num_envs, dtype=torch.bool, device=self.device)
 
         if self.viewer:
             cam_pos = gymapi.Vec3(0, 0, 1.5)
@@ -97,6 +129,17 @@ class Crazyflie(VecTask):
             self.rb_states = gymtorch.wrap_tensor(self.rb_state_tensor).view(self.num_envs, bodies_per_env, 13)
             self.rb_positions = self.rb_states[..., 0:3]
             self.rb_quats = self.rb_states[..., 3:7]
+
+            # constant across frames, so build once instead of per step
+            self._rotor_indices = torch.tensor([2, 4, 6, 8], dtype=torch.long, device=self.device)
+            self._line_colors = np.zeros((self.num_envs * 4, 3), dtype=np.float32)
+            self._line_colors[..., 0] = 1.0
+
+            # pinned staging buffer so line verts copy back asynchronously; lines
+            # are drawn one frame behind instead of synchronizing every frame
+            self._verts_host = torch.empty((self.num_envs, 4, 2, 3), dtype=torch.float32, pin_memory=True)
+            self._verts_event = torch.cuda.Event() if "cuda" in str(self.device) else None
+            self._verts_ready = False
            
        
     def create_sim(self):
@@ -162,35 +205,23 @@ class Crazyflie(VecTask):
     
         
     def set_targets(self, env_ids):
-        
-        num_sets = len(env_ids)
-        # set target positions in a circle shape
-        radius = 5.0
-        angle_increment = 2 * math.pi / num_sets
-        for i, env_id in enumerate(env_ids):
-            angle = i * angle_increment
-            x = radius * math.cos(angle)
-            y = radius * math.sin(angle)
-            self.target_root_positions[env_id, 0] = x
-            self.target_root_positions[env_id, 1] = y
-            self.target_root_positions[env_id, 2] = 1.0
-        
-        self.marker_positions[env_ids] = self.target_root_positions[env_ids]
-        actor_indices = self.all_actor_indices[env_ids, 1].flatten()
 
-        return actor_indices
-    
-    
-    def set_targets(self, env_ids):
-        
-        num_sets = len(env_ids)
-        # set target position randomly with x, y in (-5, 5) and z in (1, 2)
-        # self.target_root_positions[env_ids, 0:2] = (torch.rand(num_sets, 2, device=self.device)) 
-        # self.target_root_positions[env_ids, 2] = torch.rand(num_sets, device=self.device)
-        
-        self.target_root_positions[env_ids, 0:2] = (torch.rand(num_sets, 2, device=self.device)*0.001) 
-        self.target_root_positions[env_ids, 2] = (torch.rand(num_sets, device=self.device)*0.01)+1
-        
+        num_sets = env_ids.shape[0]
+        if self.target_layout == "circle":
+            # set target positions in a circle shape, all angles computed on device in one go
+            radius = 5.0
+            angles = torch.arange(num_sets, device=self.device, dtype=torch.float32) * (2 * math.pi / num_sets)
+            self.target_root_positions[env_ids, 0] = radius * torch.cos(angles)
+            self.target_root_positions[env_ids, 1] = radius * torch.sin(angles)
+            self.target_root_positions[env_ids, 2] = 1.0
+        else:
+            # set target position randomly with x, y in (-5, 5) and z in (1, 2)
+            # self.target_root_positions[env_ids, 0:2] = (torch.rand(num_sets, 2, device=self.device))
+            # self.target_root_positions[env_ids, 2] = torch.rand(num_sets, device=self.device)
+
+            self.target_root_positions[env_ids, 0:2] = (torch.rand(num_sets, 2, device=self.device)*0.001)
+            self.target_root_positions[env_ids, 2] = (torch.rand(num_sets, device=self.device)*0.01)+1
+
         self.marker_positions[env_ids] = self.target_root_positions[env_ids]
         # copter "position" is at the bottom of the legs, so shift the target up so it visually aligns better
         # self.marker_positions[env_ids, 2] += 0.4
@@ -200,62 +231,63 @@ class Crazyflie(VecTask):
         
     def reset_idx(self, env_ids):
         
-        num_resets = len(env_ids)
         target_actor_indices = self.set_targets(env_ids)
         actor_indices = self.all_actor_indices[env_ids, 0].flatten()
-        
-        self.root_states[env_ids] = self.initial_root_states[env_ids]
-        self.root_states[env_ids, 0] += torch_rand_float(-0, 0, (num_resets, 1), self.device).flatten()
-        self.root_states[env_ids, 1] += torch_rand_float(-0, 0, (num_resets, 1), self.device).flatten()
-        self.root_states[env_ids, 2] += torch_rand_float(-0, 0, (num_resets, 1), self.device).flatten()
-        self.gym.set_actor_root_state_tensor_indexed(self.sim, self.root_tensor, gymtorch.unwrap_tensor(actor_indices), num_resets)
+
+        self.root_positions[env_ids] = self.initial_root_positions[env_ids]
+        self.root_quats[env_ids] = self.initial_root_quats[env_ids]
+        self.root_linvels[env_ids] = self.initial_root_linvels[env_ids]
+        self.root_angvels[env_ids] = self.initial_root_angvels[env_ids]
 
         self.reset_buf[env_ids] = 0
         self.progress_buf[env_ids] = 0
+        self.target_countdown[env_ids] = self.target_update_interval
         
-        return torch.unique(torch.cat([target_actor_indices, actor_indices]))
+        # marker indices (column 1) and drone indices (column 0) are disjoint by
+        # construction, so a plain concat needs no unique/sort
+        return torch.cat([actor_indices, target_actor_indices])
         
     def pre_physics_step(self, _actions):
 
         # resets
-        set_target_ids = (self.progress_buf % 500 == 0).nonzero(as_tuple=False).squeeze(-1)
-        target_actor_indices = torch.tensor([], device=self.device, dtype=torch.int32)
-        if len(set_target_ids) > 0:
+        self.target_countdown -= 1
+        target_mask = self.target_countdown <= 0
+        set_target_ids = target_mask.nonzero(as_tuple=False).squeeze(-1)
+        target_actor_indices = self._empty_i32
+        if set_target_ids.numel() > 0:
+            self.target_countdown[target_mask] = self.target_update_interval
             target_actor_indices = self.set_targets(set_target_ids)
 
         reset_env_ids = self.reset_buf.nonzero(as_tuple=False).squeeze(-1)
-        actor_indices = torch.tensor([], device=self.device, dtype=torch.int32)
-        if len(reset_env_ids) > 0:
+        actor_indices = self._empty_i32
+        if reset_env_ids.numel() > 0:
             actor_indices = self.reset_idx(reset_env_ids)
 
-        reset_indices = torch.unique(torch.cat([target_actor_indices, actor_indices]))
-        if len(reset_indices) > 0:
-            self.gym.set_actor_root_state_tensor_indexed(self.sim, self.root_tensor, gymtorch.unwrap_tensor(reset_indices), len(reset_indices))
+        # union via mask scatter + nonzero instead of cat + unique (avoids the sort)
+        self._reset_mask.zero_()
+        self._reset_mask[target_actor_indices.long()] = True
+        self._reset_mask[actor_indices.long()] = True
+        reset_indices = self._reset_mask.nonzero(as_tuple=False).squeeze(-1).to(torch.int32)
+        if reset_indices.numel() > 0:
+            self.gym.set_actor_root_state_tensor_indexed(self.sim, self.root_tensor, gymtorch.unwrap_tensor(reset_indices), reset_indices.numel())
 
         actions = _actions.to(self.device)
         
         thrust_action_speed_scale = 200 # 200
-        
 
-        print("actions: ", actions)
+
         ######################
         # CTBR added
         total_torque, common_thrust = self.controller.update(actions, 
                                                         self.root_quats, 
                                                         self.root_linvels, 
                                                         self.root_angvels)
-        # Compute Friction forces (opposite to drone vels)
-        self.friction[:, 0, :] = -0.02*torch.sign(self.root_linvels)*self.root_linvels**2
-        print("total_torque: ", total_torque)
-        print("common_thrust: ", common_thrust)
-        print("friction: ", self.friction)
-                
-        self.forces = common_thrust + self.friction # RuntimeError: The size of tensor a (2) must match the size of tensor b (3) at non-singleton dimension 2
-        
-        print("forces: ", self.forces)
-        
-        # clear actions for reset envs
-        self.forces[reset_env_ids] = 0.0
+        # friction, thrust sum, and reset zeroing fused into one scripted graph,
+        # written into the persistent buffer so the same pointer is handed to the
+        # physics API every step; the marker body (index 1) stays zero
+        self._force_reset_mask.zero_()
+        self._force_reset_mask[reset_env_ids] = True
+        self.forces[:, 0, :] = assemble_forces(self.root_linvels, common_thrust, self._force_reset_mask)
 
         # Apply forces and torques to the drone
         self.gym.apply_rigid_body_force_tensors( self.sim, 
@@ -278,33 +310,68 @@ class Crazyflie(VecTask):
 
         self.gym.refresh_actor_root_state_tensor(self.sim)
 
-        self.compute_observations()
-        self.compute_reward()
-        
+        if self.enable_cuda_graph and "cuda" in str(self.device):
+            if self._obs_reward_graph is None:
+                self._capture_obs_reward_graph()
+            self._obs_reward_graph.replay()
+        else:
+            self.compute_observations()
+            self.compute_reward()
+
         # debug viz
         if self.viewer and self.debug_viz:
+            # submit the line geometry staged on the previous frame; waiting on the
+            # recorded event here overlaps the copy with a full simulation step
+            if self._verts_ready:
+                if self._verts_event is not None:
+                    self._verts_event.synchronize()
+                self.gym.clear_lines(self.viewer)
+                self.gym.add_lines(self.viewer, None, self.num_envs * 4, self._verts_host.numpy(), self._line_colors)
+
             # compute start and end positions for visualizing thrust lines
             self.gym.refresh_rigid_body_state_tensor(self.sim)
-            rotor_indices = torch.LongTensor([2, 4, 6, 8])
-            quats = self.rb_quats[:, rotor_indices]
+            quats = self.rb_quats[:, self._rotor_indices]
             dirs = -quat_axis(quats.view(self.num_envs * 4, 4), 2).view(self.num_envs, 4, 3)
-            starts = self.rb_positions[:, rotor_indices] + self.rotor_env_offsets
+            starts = self.rb_positions[:, self._rotor_indices] + self.rotor_env_offsets
             ends = starts + 0.1 * self.thrusts.view(self.num_envs, 4, 1) * dirs
-        
-            # submit debug line geometry
-            verts = torch.stack([starts, ends], dim=2).cpu().numpy()
-            colors = np.zeros((self.num_envs * 4, 3), dtype=np.float32)
-            colors[..., 0] = 1.0
-            self.gym.clear_lines(self.viewer)
-            self.gym.add_lines(self.viewer, None, self.num_envs * 4, verts, colors)
-        
-        
+
+            # kick off the async device-to-host copy into the pinned buffer
+            self._verts_host.copy_(torch.stack([starts, ends], dim=2), non_blocking=True)
+            if self._verts_event is not None:
+                self._verts_event.record()
+            self._verts_ready = True
+        
+        
+    def _capture_obs_reward_graph(self):
+        # the observation/reward block only reads tensors that Isaac Gym refreshes
+        # in place and writes into preallocated buffers, so the kernel sequence is
+        # static and can be captured once and replayed with a single launch
+        warmup_stream = torch.cuda.Stream()
+        warmup_stream.wait_stream(torch.cuda.current_stream())
+        with torch.cuda.stream(warmup_stream):
+            for _ in range(3):
+                self.compute_observations()
+                self.compute_reward()
+        torch.cuda.current_stream().wait_stream(warmup_stream)
+
+        self._obs_reward_graph = torch.cuda.CUDAGraph()
+        with torch.cuda.graph(self._obs_reward_graph):
+            self.compute_observations()
+            self.compute_reward()
+
     def compute_observations(self):
-        
-        self.obs_buf[..., 0:3] = (self.target_root_positions - self.root_positions) / 3
-        self.obs_buf[..., 3:7] = self.root_quats
-        self.obs_buf[..., 7:10] = self.root_linvels / 2
-        self.obs_buf[..., 10:13] = self.root_angvels / math.pi
+
+        self.obs_buf[..., 0:13] = compute_crazyflie_observations(
+            self.root_positions,
+            self.target_root_positions,
+            self.root_quats,
+            self.root_linvels,
+            self.root_angvels,
+            self.inv_pi
+        )
+        if self.bf16_obs:
+            self.obs_buf_bf16.copy_(self.obs_buf)
+            return self.obs_buf_bf16
         return self.obs_buf
     
     def compute_reward(self):
@@ -314,20 +381,46 @@ class Crazyflie(VecTask):
             self.root_quats,
             self.root_linvels,
             self.root_angvels,
-            self.reset_buf, self.progress_buf, self.max_episode_length
+            self.reset_buf, self.progress_buf, self.max_progress
         )
         
         
 #####################################################################
 ###=========================jit functions=========================###
- 
+
 @torch.jit.script
-def compute_crazyflie_reward(root_positions, target_root_positions, root_quats, root_linvels, root_angvels, reset_buf, progress_buf, max_episode_length):
-    # type: (Tensor, Tensor, Tensor, Tensor, Tensor, Tensor, Tensor, float) -> Tuple[Tensor, Tensor]
+def compute_friction(root_linvels):
+    # type: (Tensor) -> Tensor
+    # quadratic drag opposing the drone velocity, fused into a single kernel
+    return -0.02 * torch.sign(root_linvels) * root_linvels * root_linvels
 
-    # distance to target
-    target_dist = torch.sqrt(torch.square(target_root_positions - root_positions).sum(-1))
-    pos_reward = 1.0 / (1.0 + target_dist * target_dist)
+
+@torch.jit.script
+def assemble_forces(root_linvels, common_thrust, reset_mask):
+    # type: (Tensor, Tensor, Tensor) -> Tensor
+    # thrust plus drag, with freshly reset envs masked to zero in the same
+    # fused expression instead of a separate scatter
+    forces = common_thrust + compute_friction(root_linvels)
+    return forces * (~reset_mask).unsqueeze(-1).to(forces.dtype)
+
+
+@torch.jit.script
+def compute_crazyflie_observations(root_positions, target_root_positions, root_quats, root_linvels, root_angvels, inv_pi):
+    # type: (Tensor, Tensor, Tensor, Tensor, Tensor, Tensor) -> Tensor
+    return torch.cat([(target_root_positions - root_positions) / 3.0,
+                      root_quats,
+                      root_linvels * 0.5,
+                      root_angvels * inv_pi], dim=-1)
+
+
+@torch.jit.script
+def compute_crazyflie_reward(root_positions, target_root_positions, root_quats, root_linvels, root_angvels, reset_buf, progress_buf, max_progress):
+    # type: (Tensor, Tensor, Tensor, Tensor, Tensor, Tensor, Tensor, Tensor) -> Tuple[Tensor, Tensor]
+
+    # squared distance to target; the sqrt is never needed since the reward
+    # uses the square and the termination check can compare against 0.5**2
+    target_dist_sq = torch.square(target_root_positions - root_positions).sum(-1)
+    pos_reward = 1.0 / (1.0 + target_dist_sq)
 
     # uprightness
     ups = quat_axis(root_quats, 2)
@@ -342,13 +435,9 @@ def compute_crazyflie_reward(root_positions, target_root_positions, root_quats,
     # uprigness and spinning only matter when close to the target
     reward = pos_reward # + pos_reward * (up_reward + spinnage_reward)
 
-    # resets due to misbehavior
-    ones = torch.ones_like(reset_buf)
-    die = torch.zeros_like(reset_buf)
-    die = torch.where(target_dist > 0.5, ones, die)
-    die = torch.where(root_positions[..., 2] < 0.3, ones, die)
-
-    # resets due to episode length
-    reset = torch.where(progress_buf >= max_episode_length - 1, ones, die)
+    # resets due to misbehavior or episode length, as branchless boolean ops
+    reset = ((target_dist_sq > 0.25) |
+             (root_positions[..., 2] < 0.3) |
+             (progress_buf >= max_progress)).to(reset_buf.dtype)
 
     return reward, reset